@@ -5,22 +5,52 @@ SQL File Comparison Script
 This script compares all *_SQL.txt files between 'best_new_results' and 'results' folders
 across all databases in the testDBs directory. It provides detailed analysis of differences
 and generates comprehensive reports.
+
+Similarity scores are computed with rapidfuzz (pip install rapidfuzz) when it is installed;
+otherwise the script falls back to a bounded difflib.SequenceMatcher estimate.
 """
 
 import os
-import glob
+import sys
 import difflib
-import re
+import hashlib
+import itertools
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import csv
 from datetime import datetime
 
+try:
+    from rapidfuzz.fuzz import ratio as _rf_ratio
+except ImportError:
+    _rf_ratio = None
+
+# Suffix of every generated SQL file: {run_id}_prompt-{prompt_id}-{prompt_name}.txt_SQL.txt
+_SQL_SUFFIX = '.txt_SQL.txt'
+
 class SQLComparator:
+    # Files whose normalized lengths differ by more than this ratio are scored
+    # on length alone instead of being handed to SequenceMatcher
+    LENGTH_RATIO_THRESHOLD = 0.5
+    # Upper bound on the number of characters fed into SequenceMatcher
+    MAX_RATIO_CHARS = 50_000
+    # Only run the full (quadratic) ratio() when quick_ratio() exceeds this
+    QUICK_RATIO_THRESHOLD = 0.9
+    # Number of +/- diff lines kept per comparison for the console report
+    DIFF_SAMPLE_LINES = 5
+    # Stop consuming the unified diff after this many lines
+    DIFF_MAX_LINES = 200
+    CSV_FIELDNAMES = [
+        'database', 'base_name', 'status', 'results_file', 'best_file',
+        'is_identical', 'similarity_percent', 'has_differences'
+    ]
+
     def __init__(self, testdbs_path="testDBs"):
         self.testdbs_path = testdbs_path
         self.databases = []
-        self.comparison_results = defaultdict(list)
+        # db_name -> compact summary used by the console report (see summarize_results)
+        self.comparison_results = {}
         self.summary_stats = {
             'total_databases': 0,
             'total_comparisons': 0,
@@ -33,22 +63,23 @@ class SQLComparator:
         """Find all database directories with both results and best_new_results folders."""
         print("🔍 Discovering databases...")
 
-        for item in os.listdir(self.testdbs_path):
-            db_path = os.path.join(self.testdbs_path, item)
-            if os.path.isdir(db_path) and not item.startswith('.'):
-                results_path = os.path.join(db_path, 'results')
-                best_results_path = os.path.join(db_path, 'best_new_results')
-
-                if os.path.exists(results_path) and os.path.exists(best_results_path):
-                    self.databases.append({
-                        'name': item,
-                        'path': db_path,
-                        'results_path': results_path,
-                        'best_results_path': best_results_path
-                    })
-                    print(f"  ✅ Found: {item}")
-                else:
-                    print(f"  ⚠️  Skipped: {item} (missing required folders)")
+        with os.scandir(self.testdbs_path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.'):
+                    # One directory listing per database instead of a stat per required folder
+                    with os.scandir(entry.path) as sub_it:
+                        subdirs = {sub.name for sub in sub_it if sub.is_dir()}
+
+                    if 'results' in subdirs and 'best_new_results' in subdirs:
+                        self.databases.append({
+                            'name': entry.name,
+                            'path': entry.path,
+                            'results_path': os.path.join(entry.path, 'results'),
+                            'best_results_path': os.path.join(entry.path, 'best_new_results')
+                        })
+                        print(f"  ✅ Found: {entry.name}")
+                    else:
+                        print(f"  ⚠️  Skipped: {entry.name} (missing required folders)")
 
         self.summary_stats['total_databases'] = len(self.databases)
         print(f"\n📊 Found {len(self.databases)} databases to compare")
@@ -56,101 +87,142 @@ class SQLComparator:
     def extract_file_info(self, filename):
         """Extract run_id, prompt_id, and prompt_name from filename."""
         # Pattern: {run_id}_prompt-{prompt_id}-{prompt_name}.txt_SQL.txt
-        pattern = r'(\d+)_prompt-(\d+)-(.+?)\.txt_SQL\.txt'
-        match = re.match(pattern, filename)
+        if not filename.endswith(_SQL_SUFFIX):
+            return None
+        stem = filename[:-len(_SQL_SUFFIX)]
+
+        run_id, sep, rest = stem.partition('_prompt-')
+        if not sep or not run_id.isdigit():
+            return None
+
+        prompt_id, sep, prompt_name = rest.partition('-')
+        if not sep or not prompt_id.isdigit() or not prompt_name:
+            return None
+
+        return {
+            'run_id': run_id,
+            'prompt_id': prompt_id,
+            'prompt_name': prompt_name,
+            'base_name': f"prompt-{prompt_id}-{prompt_name}"
+        }
 
-        if match:
-            return {
-                'run_id': match.group(1),
-                'prompt_id': match.group(2),
-                'prompt_name': match.group(3),
-                'base_name': f"prompt-{match.group(2)}-{match.group(3)}"
-            }
-        return None
+    def _collect(self, path):
+        """Group the SQL files of one folder by base name."""
+        files = defaultdict(list)
+        with os.scandir(path) as it:
+            for entry in it:
+                if not entry.name.endswith(_SQL_SUFFIX):
+                    continue
+                file_info = self.extract_file_info(entry.name)
+                if file_info:
+                    files[file_info['base_name']].append({
+                        'path': entry.path,
+                        'filename': entry.name
+                    })
+        return dict(files)
 
     def find_sql_files(self, db_info):
         """Find and organize SQL files for a database."""
-        results_files = {}
-        best_files = {}
-
-        # Find files in results folder
-        results_pattern = os.path.join(db_info['results_path'], '*_SQL.txt')
-        for file_path in glob.glob(results_pattern):
-            filename = os.path.basename(file_path)
-            file_info = self.extract_file_info(filename)
-            if file_info:
-                base_name = file_info['base_name']
-                if base_name not in results_files:
-                    results_files[base_name] = []
-                results_files[base_name].append({
-                    'path': file_path,
-                    'filename': filename,
-                    'info': file_info
-                })
-
-        # Find files in best_new_results folder
-        best_pattern = os.path.join(db_info['best_results_path'], '*_SQL.txt')
-        for file_path in glob.glob(best_pattern):
-            filename = os.path.basename(file_path)
-            file_info = self.extract_file_info(filename)
-            if file_info:
-                base_name = file_info['base_name']
-                if base_name not in best_files:
-                    best_files[base_name] = []
-                best_files[base_name].append({
-                    'path': file_path,
-                    'filename': filename,
-                    'info': file_info
-                })
-
+        results_files = self._collect(db_info['results_path'])
+        best_files = self._collect(db_info['best_results_path'])
         return results_files, best_files
 
-    def normalize_sql(self, sql_content):
-        """Normalize SQL content for better comparison."""
-        # Remove extra whitespace and normalize formatting
-        lines = []
-        for line in sql_content.split('\n'):
-            # Strip whitespace and normalize
-            cleaned_line = ' '.join(line.strip().split())
-            if cleaned_line:  # Skip empty lines
-                lines.append(cleaned_line)
-        return '\n'.join(lines)
+    @staticmethod
+    def normalize_sql(sql_content):
+        """Normalize SQL content for better comparison, returned as UTF-8 bytes."""
+        if isinstance(sql_content, str):
+            sql_content = sql_content.encode('utf-8')
+        # Collapse all whitespace (including line breaks) into single spaces
+        return b' '.join(sql_content.split())
+
+    def _load(self, file_path):
+        """Return the raw content, normalized content and its SHA-256 digest for a file."""
+        # Every file is compared exactly once, so nothing is kept around after the comparison
+        # Read raw bytes in one large buffered read and decode once
+        with open(file_path, 'rb', buffering=1 << 20) as f:
+            data = f.read()
+        content = data.decode('utf-8', errors='replace')
+        # Normalize and hash the raw bytes directly, the decoded text is only needed for the diff
+        norm_content = self.normalize_sql(data)
+        digest = hashlib.sha256(norm_content).digest()
+        return content, norm_content, digest
+
+    def calculate_similarity(self, norm_content1, norm_content2):
+        """Estimate the similarity of two normalized SQL byte strings, avoiding the
+        quadratic SequenceMatcher.ratio() whenever a cheaper bound suffices."""
+        if norm_content1 == norm_content2:
+            return 1.0
+
+        l1, l2 = len(norm_content1), len(norm_content2)
+        if not l1 or not l2:
+            return 0.0
+
+        # rapidfuzz computes the exact Indel ratio in C++, no need for the estimates below
+        if _rf_ratio is not None:
+            return _rf_ratio(norm_content1, norm_content2) / 100.0
+
+        # Very different lengths cannot be very similar; the length ratio is a good enough score
+        length_ratio = min(l1, l2) / max(l1, l2)
+        if length_ratio < self.LENGTH_RATIO_THRESHOLD:
+            return length_ratio
+
+        # Keep SequenceMatcher bounded on large SQL dumps
+        a = norm_content1[:self.MAX_RATIO_CHARS]
+        b = norm_content2[:self.MAX_RATIO_CHARS]
+
+        matcher = difflib.SequenceMatcher(None, a, b, autojunk=True)
+        quick_ratio = matcher.quick_ratio()
+        if quick_ratio <= self.QUICK_RATIO_THRESHOLD:
+            return quick_ratio
+        return matcher.ratio()
+
+    def sample_diff(self, content1, content2, file1_path, file2_path):
+        """Stream a unified diff, returning the first +/- lines and the number of diff
+        lines seen (capped at DIFF_MAX_LINES)."""
+        diff = difflib.unified_diff(
+            content1.splitlines(keepends=True),
+            content2.splitlines(keepends=True),
+            fromfile=f"results/{os.path.basename(file1_path)}",
+            tofile=f"best_new_results/{os.path.basename(file2_path)}",
+            lineterm=''
+        )
+
+        diff_sample = []
+        diff_line_count = 0
+        for line in itertools.islice(diff, self.DIFF_MAX_LINES):
+            diff_line_count += 1
+            if len(diff_sample) < self.DIFF_SAMPLE_LINES and (line.startswith('+') or line.startswith('-')):
+                diff_sample.append(line)
+        return diff_sample, diff_line_count
 
     def compare_sql_content(self, file1_path, file2_path):
         """Compare two SQL files and return detailed diff information."""
         try:
-            with open(file1_path, 'r', encoding='utf-8') as f1:
-                content1 = f1.read()
-            with open(file2_path, 'r', encoding='utf-8') as f2:
-                content2 = f2.read()
-
-            # Normalize content for comparison
-            norm_content1 = self.normalize_sql(content1)
-            norm_content2 = self.normalize_sql(content2)
+            # Read and normalize content for comparison
+            content1, norm_content1, digest1 = self._load(file1_path)
+            content2, norm_content2, digest2 = self._load(file2_path)
 
             # Check if identical
-            is_identical = norm_content1 == norm_content2
+            is_identical = digest1 == digest2
+            if is_identical:
+                return {
+                    'is_identical': True,
+                    'similarity': 1.0,
+                    'diff_sample': [],
+                    'diff_line_count': 0
+                }
 
-            # Generate detailed diff
-            diff = list(difflib.unified_diff(
-                content1.splitlines(keepends=True),
-                content2.splitlines(keepends=True),
-                fromfile=f"results/{os.path.basename(file1_path)}",
-                tofile=f"best_new_results/{os.path.basename(file2_path)}",
-                lineterm=''
-            ))
+            # Keep only a small sample of the diff, the full diff is never stored
+            diff_sample, diff_line_count = self.sample_diff(content1, content2, file1_path, file2_path)
 
             # Calculate similarity percentage
-            similarity = difflib.SequenceMatcher(None, norm_content1, norm_content2).ratio()
+            similarity = self.calculate_similarity(norm_content1, norm_content2)
 
             return {
                 'is_identical': is_identical,
                 'similarity': similarity,
-                'diff': diff,
-                'content1': content1,
-                'content2': content2,
-                'norm_content1': norm_content1,
-                'norm_content2': norm_content2
+                'diff_sample': diff_sample,
+                'diff_line_count': diff_line_count
             }
 
         except Exception as e:
@@ -158,14 +230,23 @@ class SQLComparator:
                 'error': str(e),
                 'is_identical': False,
                 'similarity': 0.0,
-                'diff': [],
-                'content1': '',
-                'content2': ''
+                'diff_sample': [],
+                'diff_line_count': 0
             }
 
     def compare_database(self, db_info):
-        """Compare all SQL files for a single database."""
-        print(f"\n🔍 Comparing database: {db_info['name']}")
+        """Compare all SQL files for a single database.
+
+        Runs in a worker process, so it does not touch the shared report state and
+        buffers its console output. Returns (db_name, db_results, local_stats, log_lines).
+        """
+        log_lines = [f"\n🔍 Comparing database: {db_info['name']}"]
+        local_stats = {
+            'total_comparisons': 0,
+            'identical_files': 0,
+            'different_files': 0,
+            'missing_files': 0
+        }
 
         results_files, best_files = self.find_sql_files(db_info)
 
@@ -190,8 +271,8 @@ class SQLComparator:
                         'comparison': None
                     }
                     db_results.append(result)
-                    self.summary_stats['missing_files'] += 1
-                    print(f"  📄 {base_name}: Only in best_new_results ({best_file['filename']})")
+                    local_stats['missing_files'] += 1
+                    log_lines.append(f"  📄 {base_name}: Only in best_new_results ({best_file['filename']})")
 
             elif results_list and not best_list:
                 # File only in results
@@ -205,8 +286,8 @@ class SQLComparator:
                         'comparison': None
                     }
                     db_results.append(result)
-                    self.summary_stats['missing_files'] += 1
-                    print(f"  📄 {base_name}: Only in results ({results_file['filename']})")
+                    local_stats['missing_files'] += 1
+                    log_lines.append(f"  📄 {base_name}: Only in results ({results_file['filename']})")
 
             else:
                 # Files exist in both folders - compare them
@@ -226,18 +307,17 @@ class SQLComparator:
                     'comparison': comparison
                 }
                 db_results.append(result)
-                self.summary_stats['total_comparisons'] += 1
+                local_stats['total_comparisons'] += 1
 
                 if comparison['is_identical']:
-                    self.summary_stats['identical_files'] += 1
-                    print(f"  ✅ {base_name}: Identical")
+                    local_stats['identical_files'] += 1
+                    log_lines.append(f"  ✅ {base_name}: Identical")
                 else:
-                    self.summary_stats['different_files'] += 1
+                    local_stats['different_files'] += 1
                     similarity_pct = comparison['similarity'] * 100
-                    print(f"  🔄 {base_name}: Different (similarity: {similarity_pct:.1f}%)")
+                    log_lines.append(f"  🔄 {base_name}: Different (similarity: {similarity_pct:.1f}%)")
 
-        self.comparison_results[db_info['name']] = db_results
-        return db_results
+        return db_info['name'], db_results, local_stats, log_lines
 
     def generate_console_report(self):
         """Generate a detailed console report."""
@@ -258,72 +338,78 @@ class SQLComparator:
 
         print("\n🔍 Detailed Analysis by Database:")
 
-        for db_name, results in self.comparison_results.items():
-            print(f"\n📁 {db_name}:")
-
-            different_files = [r for r in results if r['status'] == 'compared' and not r['comparison']['is_identical']]
-            identical_files = [r for r in results if r['status'] == 'compared' and r['comparison']['is_identical']]
-            missing_files = [r for r in results if r['status'] in ['only_in_best', 'only_in_results']]
-
-            print(f"  📊 Summary: {len(identical_files)} identical, {len(different_files)} different, {len(missing_files)} missing")
-
-            if different_files:
-                print(f"  🔄 Different files:")
-                for result in different_files:
-                    similarity = result['comparison']['similarity'] * 100
-                    print(f"    - {result['base_name']}: {similarity:.1f}% similar")
-
-                    # Show a sample of the differences
-                    diff_lines = result['comparison']['diff']
-                    if diff_lines:
-                        print(f"      Sample differences:")
-                        for i, line in enumerate(diff_lines[:5]):  # Show first 5 diff lines
-                            if line.startswith('+') or line.startswith('-'):
-                                print(f"        {line.rstrip()}")
-                        if len(diff_lines) > 5:
-                            print(f"        ... and {len(diff_lines) - 5} more differences")
-
-            if missing_files:
-                print(f"  ⚠️  Missing files:")
-                for result in missing_files:
-                    print(f"    - {result['base_name']}: {result['status']}")
-
-    def save_csv_report(self, filename="sql_comparison_report.csv"):
-        """Save comparison results to CSV file."""
-        print(f"\n💾 Saving CSV report to: {filename}")
-
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = [
-                'database', 'base_name', 'status', 'results_file', 'best_file',
-                'is_identical', 'similarity_percent', 'has_differences'
+        for db_name, summary in self.comparison_results.items():
+            lines = [
+                f"\n📁 {db_name}:",
+                f"  📊 Summary: {summary['identical_count']} identical, {summary['different_count']} different, {len(summary['missing_lines'])} missing"
             ]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-
-            for db_name, results in self.comparison_results.items():
-                for result in results:
-                    row = {
-                        'database': result['database'],
-                        'base_name': result['base_name'],
-                        'status': result['status'],
-                        'results_file': result['results_file'] or '',
-                        'best_file': result['best_file'] or '',
-                        'is_identical': '',
-                        'similarity_percent': '',
-                        'has_differences': ''
-                    }
-
-                    if result['comparison']:
-                        row['is_identical'] = result['comparison']['is_identical']
-                        row['similarity_percent'] = f"{result['comparison']['similarity'] * 100:.1f}"
-                        row['has_differences'] = not result['comparison']['is_identical']
-
-                    writer.writerow(row)
-
-        print(f"✅ CSV report saved successfully")
+            if summary['different_lines']:
+                lines.append("  🔄 Different files:")
+                lines.extend(summary['different_lines'])
+            if summary['missing_lines']:
+                lines.append("  ⚠️  Missing files:")
+                lines.extend(summary['missing_lines'])
+
+            # One write per database instead of one print per line
+            sys.stdout.write('\n'.join(lines) + '\n')
+
+    def summarize_results(self, results):
+        """Reduce one database's results to the counts and rendered lines the console report needs."""
+        # Classify and render every result in a single pass
+        identical_count = 0
+        different_count = 0
+        different_lines = []
+        missing_lines = []
+        for result in results:
+            status = result['status']
+            if status == 'compared':
+                comparison = result['comparison']
+                if comparison['is_identical']:
+                    identical_count += 1
+                    continue
+
+                different_count += 1
+                different_lines.append(f"    - {result['base_name']}: {comparison['similarity'] * 100:.1f}% similar")
+
+                # Show a sample of the differences
+                diff_sample = comparison['diff_sample']
+                if diff_sample:
+                    different_lines.append("      Sample differences:")
+                    different_lines.extend(f"        {line.rstrip()}" for line in diff_sample)
+                    diff_line_count = comparison['diff_line_count']
+                    if diff_line_count > self.DIFF_SAMPLE_LINES:
+                        more = '+' if diff_line_count >= self.DIFF_MAX_LINES else ''
+                        different_lines.append(f"        ... and {diff_line_count - self.DIFF_SAMPLE_LINES}{more} more differences")
+            elif status in ('only_in_best', 'only_in_results'):
+                missing_lines.append(f"    - {result['base_name']}: {status}")
+
+        return {
+            'identical_count': identical_count,
+            'different_count': different_count,
+            'different_lines': different_lines,
+            'missing_lines': missing_lines
+        }
 
-    def run_comparison(self):
-        """Run the complete comparison process."""
+    @staticmethod
+    def csv_rows(results):
+        """Build the CSV report rows for one database's results."""
+        return [
+            (
+                result['database'],
+                result['base_name'],
+                result['status'],
+                result['results_file'] or '',
+                result['best_file'] or '',
+                comparison['is_identical'] if comparison else '',
+                f"{comparison['similarity'] * 100:.1f}" if comparison else '',
+                (not comparison['is_identical']) if comparison else ''
+            )
+            for result in results
+            for comparison in (result['comparison'],)
+        ]
+
+    def run_comparison(self, filename="sql_comparison_report.csv"):
+        """Run the complete comparison process, writing the CSV report to filename."""
         print("🚀 Starting SQL file comparison...")
 
         # Discover databases
@@ -333,13 +419,27 @@ class SQLComparator:
             print("❌ No databases found to compare")
             return
 
-        # Compare each database
-        for db_info in self.databases:
-            self.compare_database(db_info)
+        print(f"\n💾 Writing CSV report to: {filename}")
+
+        # Compare databases in parallel, one worker process per database, and stream each
+        # database's rows to the CSV as soon as it is done so its full results can be released
+        with open(filename, 'w', newline='', encoding='utf-8', buffering=1 << 20) as csvfile, \
+                ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            writer = csv.writer(csvfile)
+            writer.writerow(self.CSV_FIELDNAMES)
+
+            # map() yields in submission order, which keeps the CSV and report order stable
+            for db_name, db_results, local_stats, log_lines in executor.map(self.compare_database, self.databases):
+                print('\n'.join(log_lines))
+                for key, value in local_stats.items():
+                    self.summary_stats[key] += value
+                writer.writerows(self.csv_rows(db_results))
+                self.comparison_results[db_name] = self.summarize_results(db_results)
+
+        print(f"✅ CSV report saved successfully")
 
-        # Generate reports
+        # Generate console report
         self.generate_console_report()
-        self.save_csv_report()
 
         print(f"\n🎉 Comparison complete! Check the CSV report for detailed results.")
 
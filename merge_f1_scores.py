@@ -7,8 +7,6 @@ The script includes normal f1, relaxed_f1, and textual_f1 metrics organized by p
 import pandas as pd
 import os
 import glob
-from collections import defaultdict
-import numpy as np
 
 def main():
     # Define the path to the best_new_plots folder
@@ -27,9 +25,8 @@ def main():
         for file in files:
             print(f"  - {file}")
 
-    # Dictionary to store all data organized by dataset
-    # Structure: {dataset: {version: {prompt: {metric: score}}}}
-    dataset_data = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+    # Collect all scores into one long-form DataFrame
+    frames = []
 
     # Process each metric type
     for metric in metric_types:
@@ -45,17 +42,14 @@ def main():
             # Read the CSV file
             df = pd.read_csv(file_path)
 
-            # Process each row in the file
-            for _, row in df.iterrows():
-                folder = row['Folder']
-                prompt = int(row['Prompt'])
-                score = float(row['f1'])  # All files use 'f1' as the column name
-
+            frames.append(pd.DataFrame({
+                'Dataset': dataset_name,
                 # Extract version from folder name (e.g., "V1" from "BPI2016-V1")
-                version = folder.split('-')[-1]  # Gets the last part after splitting by '-'
-
-                # Store the data
-                dataset_data[dataset_name][version][prompt][metric] = score
+                'Version': df['Folder'].str.rsplit('-', n=1).str[-1],
+                'Prompt': df['Prompt'].astype(int),
+                'Metric': metric,
+                'Score': df['f1'].astype(float)  # All files use 'f1' as the column name
+            }))
 
             print(f"    Processed {len(df)} records for {dataset_name} {metric}")
 
@@ -64,36 +58,28 @@ def main():
     versions = ["V1", "V2", "V3"]
     prompts = [1, 2, 3, 4, 5, 6, 7]
 
-    # Create separate DataFrames for each dataset
-    dataset_dfs = []
-
-    for dataset in datasets:
-        # Create column headers: Dataset, Prompt, then for each version: V1_f1, V1_relaxed_f1, V1_textual_f1, etc.
-        columns = ["Dataset", "Prompt"]
-        for version in versions:
-            for metric in metric_types:
-                columns.append(f"{version}_{metric}")
-
-        # Create rows for each prompt
-        dataset_rows = []
-        for prompt in prompts:
-            row = [dataset, f"Prompt_{prompt}"]
-
-            # Add all metric scores for each version
-            for version in versions:
-                for metric in metric_types:
-                    # Get the metric score, use NaN if not available
-                    score = dataset_data[dataset][version].get(prompt, {}).get(metric, np.nan)
-                    row.append(score)
-
-            dataset_rows.append(row)
-
-        # Create DataFrame for this dataset
-        dataset_df = pd.DataFrame(dataset_rows, columns=columns)
-        dataset_dfs.append(dataset_df)
-
-    # Combine all dataset DataFrames
-    merged_df = pd.concat(dataset_dfs, ignore_index=True)
+    # Pivot to one row per (Dataset, Prompt) and one column per (version, metric)
+    if frames:
+        long_df = pd.concat(frames, ignore_index=True, copy=False)
+        wide_df = long_df.pivot_table(index=['Dataset', 'Prompt'], columns=['Version', 'Metric'], values='Score')
+    else:
+        wide_df = pd.DataFrame()
+
+    # Reindex onto the expected structure so missing combinations become NaN
+    wide_df = wide_df.reindex(
+        index=pd.MultiIndex.from_product([datasets, prompts], names=['Dataset', 'Prompt']),
+        columns=pd.MultiIndex.from_product([versions, metric_types], names=['Version', 'Metric'])
+    ).astype('float64')
+
+    # Flatten column headers: V1_f1, V1_relaxed_f1, V1_textual_f1, etc.
+    wide_df.columns = [f"{version}_{metric}" for version, metric in wide_df.columns]
+
+    merged_df = wide_df.reset_index()
+    # Keep Prompt labels as a categorical so they never upcast the metric columns
+    merged_df['Prompt'] = pd.Categorical(
+        'Prompt_' + merged_df['Prompt'].astype(str),
+        categories=[f"Prompt_{prompt}" for prompt in prompts]
+    )
 
     # Display the merged data
     print("\n" + "="*80)
@@ -123,41 +109,40 @@ def main():
     print(f"Missing data points: {missing_cells}")
     print(f"Coverage: {(filled_cells/total_cells)*100:.1f}%")
 
+    missing_mask = merged_df[metric_columns].isna()
+
     # Show missing data by dataset
     print("\nMissing data by dataset:")
-    for dataset in datasets:
-        dataset_rows = merged_df[merged_df['Dataset'] == dataset]
-        missing_count = dataset_rows[metric_columns].isna().sum().sum()
-        total_points = len(prompts) * len(versions) * len(metric_types)
+    missing_by_dataset = missing_mask.groupby(merged_df['Dataset']).sum().sum(axis=1)
+    total_points = len(prompts) * len(versions) * len(metric_types)
+    for dataset, missing_count in missing_by_dataset.items():
         print(f"  {dataset}: {missing_count}/{total_points} missing ({(missing_count/total_points)*100:.1f}%)")
 
-    # Show missing data by metric type
+    # Show missing data by metric type (strip the "V1_" version prefix from each column, so that
+    # relaxed_f1 and textual_f1 columns are no longer also counted under f1)
     print("\nMissing data by metric type:")
+    missing_by_metric = missing_mask.sum().groupby(lambda col: col.split('_', 1)[1]).sum()
+    total_points = len(datasets) * len(prompts) * len(versions)
     for metric in metric_types:
-        metric_cols = [col for col in metric_columns if col.endswith(f"_{metric}")]
-        missing_count = merged_df[metric_cols].isna().sum().sum()
-        total_points = len(datasets) * len(prompts) * len(versions)
+        missing_count = missing_by_metric.get(metric, 0)
         print(f"  {metric}: {missing_count}/{total_points} missing ({(missing_count/total_points)*100:.1f}%)")
 
     # Show which specific prompt-version-metric combinations are missing
     print("\nDetailed missing data analysis:")
+    # One (Dataset, Prompt, column) entry per missing cell
+    missing_entries = merged_df.set_index(['Dataset', 'Prompt'])[metric_columns].isna().stack()
+    missing_entries = missing_entries[missing_entries]
+    missing_by_dataset_cells = {dataset: cells.index for dataset, cells in missing_entries.groupby(level='Dataset')}
+
     for dataset in datasets:
-        dataset_rows = merged_df[merged_df['Dataset'] == dataset]
-
-        missing_found = False
-        for _, row in dataset_rows.iterrows():
-            prompt = row['Prompt']
-            for version in versions:
-                for metric in metric_types:
-                    col_name = f"{version}_{metric}"
-                    if pd.isna(row[col_name]):
-                        if not missing_found:
-                            print(f"\n{dataset} missing data:")
-                            missing_found = True
-                        print(f"  - {prompt} {col_name}")
-
-        if not missing_found:
+        cells = missing_by_dataset_cells.get(dataset)
+        if cells is None:
             print(f"\n{dataset}: No missing data")
+            continue
+
+        print(f"\n{dataset} missing data:")
+        for _, prompt, col_name in cells:
+            print(f"  - {prompt} {col_name}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,20 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("rapidfuzz")
+
+from utils.metrics import dataframe_similarity, join_rows
+
+
+def test_join_rows_empty_frame():
+    assert join_rows(pd.DataFrame(columns=["case_id", "activity_id"])) == []
+
+
+def test_empty_result_frame_scores_zero():
+    columns = ["case_id", "activity_id", "activity"]
+    ground_truth = pd.DataFrame([["1", "a1", "Create PO"], ["2", "a2", "Pay"]], columns=columns)
+    empty = pd.DataFrame(columns=columns)
+
+    for df1, df2 in ((empty, ground_truth), (ground_truth, empty), (empty, empty)):
+        result = dataframe_similarity(df1, df2)
+        assert all(value == 0 for value in result.values())
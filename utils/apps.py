@@ -10,6 +10,10 @@ class SimpleApp():
         self.path_to_db = path_to_db
         self.llm_model = llm_model 
         self.path_to_groud_truth_eventlog=path_to_groud_truth_eventlog
+        # the ground truth does not change between invocations, parse it only once
+        self._df_true = pd.read_csv(path_to_groud_truth_eventlog, dtype='object')
+        # the graph is the same for every invocation, compile it only once
+        self._app = self.build_workflow()
 
     def get_sql_query(self, state):
         messages = state['messages']
@@ -36,14 +40,13 @@ class SimpleApp():
     
     def calculate_metrics(self, state):
         if type(state['sqlexecuter']) != str:
-            df_true = pd.read_csv(self.path_to_groud_truth_eventlog, dtype='object')
-            state['result'] = dataframe_similarity(df_true, state['sqlexecuter'])
+            state['result'] = dataframe_similarity(self._df_true, state['sqlexecuter'])
         else:
             state['result'] = {}
         return state
         
     
-    def invoke(self, AgentState):
+    def build_workflow(self):
         workflow = StateGraph(dict)
         # nodes
         workflow.add_node("agent", self.get_sql_query)
@@ -55,7 +58,8 @@ class SimpleApp():
         # entry, exit
         workflow.set_entry_point("agent")
         workflow.set_finish_point("dfcomparator")
-        app = workflow.compile()
-        app.invoke(AgentState)
-        return AgentState
+        return workflow.compile()
 
+    def invoke(self, AgentState):
+        self._app.invoke(AgentState)
+        return AgentState
@@ -1,74 +1,119 @@
 import os
+import logging
 import sqlite3
+from functools import lru_cache
 import pandas as pd
 import numpy as np
+from graphlib import TopologicalSorter, CycleError
+
+# Parquet sidecars make repeated database rebuilds skip the CSV parse, only used when pyarrow is installed
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# Tag in the sidecar file names, bump it whenever read_table_csv parses differently so stale sidecars are ignored.
+# The sidecars live in a git-ignored _cache folder next to the CSVs.
+_SIDECAR_FORMAT = 'str-v1'
+
+# Query results use Arrow-backed dtypes when pyarrow is installed, the default NumPy dtypes otherwise
+_READ_SQL_KWARGS = {'dtype_backend': 'pyarrow'} if pq is not None else {}
+
+logger = logging.getLogger(__name__)
 
 # Function to safely quote identifiers
 def quote_identifier(identifier):
     return f'"{identifier}"'
     #return f"'{identifier}'" 
 
-# Discover and Load CSV Files
+# Discover CSV Files, only the header is read here and the data is loaded when it is inserted
 def discover_csv_files_and_structure(directory):
     files_structure = {}
     for filename in os.listdir(directory):
         if filename.endswith('.csv'):
             table_name = filename.split('.')[0]
-            df = pd.read_csv(os.path.join(directory, filename))
+            csv_path = os.path.join(directory, filename)
             files_structure[table_name] = {
-                'columns': df.columns.tolist(),
-                'data': df
+                'columns': pd.read_csv(csv_path, nrows=0).columns.tolist(),
+                'path': csv_path,
+                'parquet_path': os.path.join(directory, '_cache', f"{table_name}.{_SIDECAR_FORMAT}.parquet")
             }
     return files_structure
 
+def load_table_data(details):
+    """Return the data of a discovered table, reading it on first use."""
+    if 'data' not in details:
+        details['data'] = load_csv_with_parquet_cache(details['path'], details['parquet_path'])
+    return details['data']
+
+def read_table_csv(csv_path):
+    # Every value is stored through SQLite's column affinity anyway, so skip pandas' dtype inference
+    return pd.read_csv(csv_path, dtype=str, engine='c', low_memory=False)
+
+def load_csv_with_parquet_cache(csv_path, pq_path):
+    """Load a CSV, reusing its parquet sidecar when it is at least as new as the CSV."""
+    if pq is None:
+        return read_table_csv(csv_path)
+    if os.path.exists(pq_path) and os.path.getmtime(pq_path) >= os.path.getmtime(csv_path):
+        return pq.read_table(pq_path).to_pandas()
+    df = read_table_csv(csv_path)
+    try:
+        os.makedirs(os.path.dirname(pq_path), exist_ok=True)
+        df.to_parquet(pq_path, compression='zstd', index=False)
+    except Exception as e:
+        # Not every CSV maps cleanly onto parquet, the cache is only an optimisation
+        logger.warning("Could not write parquet cache %s: %s", pq_path, e)
+    return df
+
 # Discover csv schema
 def read_csv_schema_from_excel(csv_schema_excel_path):
     """Read relationships and structure information from an Excel file."""
     relationships_df = pd.read_excel(csv_schema_excel_path)
     relationships = {}
     column_types = {}
-    for _, row in relationships_df.iterrows():
-        table_name = row['table_name']
-        column_name = row['column']
-        column_data_type = row['data_type']
-        column_type = row['type']
+    # Walk the raw column arrays instead of materialising a Series per row with iterrows
+    table_names = relationships_df['table_name'].to_numpy()
+    column_names = relationships_df['column'].to_numpy()
+    column_data_types = relationships_df['data_type'].to_numpy()
+    column_type_values = relationships_df['type'].to_numpy()
+    target_tables = relationships_df['target_table'].to_numpy()
+    target_columns = relationships_df['target_column'].to_numpy()
+    for i in range(len(relationships_df)):
+        table_name = table_names[i]
+        column_name = column_names[i]
+        column_type = column_type_values[i]
+        # Missing types come through as NaN floats, so a str check doubles as the notna check
+        is_fk = isinstance(column_type, str) and 'FK' in column_type
 
         column_details = {
             'type': column_type,
-            'data_type':column_data_type,
-            'target_table': row['target_table'] if (pd.notna(column_type) and 'FK' in column_type) else None,
-            'target_column': row['target_column'] if (pd.notna(column_type) and 'FK' in column_type) else None
+            'data_type':column_data_types[i],
+            'target_table': target_tables[i] if is_fk else None,
+            'target_column': target_columns[i] if is_fk else None
         }
         column_types.setdefault(table_name, {})[column_name] = column_details
-        if pd.notna(column_type) and 'FK' in column_type:
-            relationships[(table_name, column_name)] = row['target_table']#(row['target_table'], row['target_column'])
+        if is_fk:
+            relationships[(table_name, column_name)] = target_tables[i]#(row['target_table'], row['target_column'])
     return relationships, column_types
 
 def sort_tables_by_dependency(relationships):
-    # Initialize containers for tracking table relationships
-    all_tables = set()
-    dependency_map = {}
-    
-    # Populate the dependency map and all_tables set
+    """Order tables so that every table comes after the tables its foreign keys reference."""
+    ts = TopologicalSorter()
     for (table_name, column), ref_table in relationships.items():
-        all_tables.add(table_name)
-        all_tables.add(ref_table)
-        if table_name not in dependency_map:
-            dependency_map[table_name] = set()
-        dependency_map[table_name].add(ref_table)
-    
-    # Identify independent tables (those not depending on other tables)
-    independent_tables = {table for table in all_tables if table not in dependency_map}
-    
-    # The sorted list starts with independent tables
-    sorted_tables = list(independent_tables)
-    
-    # Add dependent tables to the sorted list
-    for table in dependency_map:
-        if table not in sorted_tables:
-            sorted_tables.append(table)
-    
-    return sorted_tables
+        if ref_table == table_name:
+            # A self-reference does not constrain the order between tables
+            ts.add(table_name)
+        else:
+            ts.add(table_name, ref_table)
+
+    try:
+        return list(ts.static_order())
+    except CycleError:
+        # Mutually dependent tables have no valid order, keep the order they were declared in
+        tables = []
+        for (table_name, column), ref_table in relationships.items():
+            tables.extend([ref_table, table_name])
+        return list(dict.fromkeys(tables))
 
 def create_database_and_tables(files_structure, sorted_table_names, column_types, db_output_dir='example.db'):
     """Create a database and tables based on the defined CSV structure and relationships from the Excel file."""
@@ -81,6 +126,12 @@ def create_database_and_tables(files_structure, sorted_table_names, column_types
 
     # Enable foreign key support 
     cur.execute("PRAGMA foreign_keys = ON")
+
+    # Speed up the bulk load: keep the rollback journal in memory and skip fsyncs,
+    # the database is rebuilt from scratch anyway if the load is interrupted
+    cur.execute("PRAGMA journal_mode = MEMORY")
+    cur.execute("PRAGMA synchronous = OFF")
+    cur.execute("PRAGMA temp_store = MEMORY")
     
     # Create tables using schema information from the Excel file
     for table_name, details in files_structure.items():
@@ -115,31 +166,42 @@ def create_database_and_tables(files_structure, sorted_table_names, column_types
             column_defs.append(primary_keys_sql)
         
         create_table_sql = f"CREATE TABLE {quote_identifier(table_name)} ({', '.join(column_defs + foreign_keys_sql)})"
-        print(create_table_sql)
+        logger.debug("%s", create_table_sql)
         cur.execute(create_table_sql)
     
     def insert_data_into_db(table_name):
-        details = files_structure[table_name]
-        details['data'].to_sql(table_name, conn, if_exists='append', index=False, method="multi")
-        print(f"Data inserted into table {table_name}")
+        df = load_table_data(files_structure[table_name])
+        # Plain executemany skips the per-chunk overhead of to_sql; all tables go into one transaction
+        # that is committed below. NaN floats are stored as NULL by SQLite itself.
+        cols = ', '.join(quote_identifier(col) for col in df.columns)
+        placeholders = ', '.join('?' * len(df.columns))
+        insert_sql = f"INSERT INTO {quote_identifier(table_name)} ({cols}) VALUES ({placeholders})"
+        cur.executemany(insert_sql, df.itertuples(index=False, name=None))
+        logger.debug("Data inserted into table %s", table_name)
 
     # Insert data in sorted order
-    all_tables_to_process = sorted_table_names+list(set(list(files_structure.keys()))-set(sorted_table_names))
-    print(f"DEBUG: files_structure keys: {list(files_structure.keys())}")
-    print(f"DEBUG: sorted_table_names: {sorted_table_names}")
-    print(f"DEBUG: all_tables_to_process: {all_tables_to_process}")
+    # Dependency order first, then any tables without relationships, each table only once
+    all_tables_to_process = list(dict.fromkeys(list(sorted_table_names) + list(files_structure.keys())))
+    logger.debug("files_structure keys: %s", list(files_structure.keys()))
+    logger.debug("sorted_table_names: %s", sorted_table_names)
+    logger.debug("all_tables_to_process: %s", all_tables_to_process)
     
     for table_name in all_tables_to_process:
         if table_name not in files_structure:
-            print(f"ERROR: Table '{table_name}' not found in files_structure")
+            logger.error("Table '%s' not found in files_structure", table_name)
             continue
         insert_data_into_db(table_name)
 
     conn.commit()
     conn.close()
-    print('Database created: ' + db_output_dir)
+    logger.debug('Database created: %s', db_output_dir)
 
 def get_database_schema(path_to_db):
+    # Keyed on the modification time so a rebuilt database is read again
+    return _get_database_schema_cached(path_to_db, os.path.getmtime(path_to_db))
+
+@lru_cache(maxsize=256)
+def _get_database_schema_cached(path_to_db, mtime):
     conn = sqlite3.connect(path_to_db)
     schema = []
     cur = conn.cursor()
@@ -149,11 +211,17 @@ def get_database_schema(path_to_db):
     return "\n".join(schema)
 
 def get_list_tables(path_to_db):
+    # Return a copy so callers cannot modify the cached list
+    return list(_get_list_tables_cached(path_to_db, os.path.getmtime(path_to_db)))
+
+@lru_cache(maxsize=256)
+def _get_list_tables_cached(path_to_db, mtime):
     conn = sqlite3.connect(path_to_db)
     cur = conn.cursor()
     cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
     tables = cur.fetchall()
-    return [table[0] for table in tables]  # Extract table names from tuples
+    conn.close()
+    return tuple(table[0] for table in tables)  # Extract table names from tuples
 
 def inspect_table(path_to_db, table_name, limit=5):
     conn = sqlite3.connect(path_to_db)
@@ -165,22 +233,34 @@ def inspect_table(path_to_db, table_name, limit=5):
     for row in rows:
         print(row)
 
-def run_query_and_return_df(path_to_db, query, params=None):
+def run_query_and_return_df(path_to_db, query, params=None, chunksize=None):
     """
     Executes a SQL query and returns the results as a pandas DataFrame.
     
     :param path_to_db: The path to the SQLite database file.
     :param query: The SQL query string to be executed.
     :param params: Optional parameters to be bound to the query. Defaults to None.
-    :return: A pandas DataFrame containing the results of the query.
+    :param chunksize: Optional number of rows per chunk. When set, an iterator of DataFrames is returned instead.
+    :return: A pandas DataFrame (Arrow-backed dtypes when pyarrow is installed) containing the results of the query.
     """
+    if chunksize is not None:
+        return _iter_query_chunks(path_to_db, query, params, chunksize)
+
     # Connect to the SQLite database
     with sqlite3.connect(path_to_db) as conn:
         # If params is None, pandas will execute the query without parameters
-        df = pd.read_sql_query(query, conn, params=params)
+        df = pd.read_sql_query(query, conn, params=params, **_READ_SQL_KWARGS)
     conn.close()
     return df
 
+def _iter_query_chunks(path_to_db, query, params, chunksize):
+    # The connection has to stay open until the caller has consumed every chunk
+    conn = sqlite3.connect(path_to_db)
+    try:
+        yield from pd.read_sql_query(query, conn, params=params, chunksize=chunksize, **_READ_SQL_KWARGS)
+    finally:
+        conn.close()
+
 def get_database_schema_execute_all(path_to_csv_files,path_to_csv_schema_file, db_output_dir):
     # Main execution flow
     files_structure = discover_csv_files_and_structure(path_to_csv_files)
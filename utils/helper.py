@@ -2,6 +2,14 @@ import os
 import csv
 import re
 
+# RE2 guarantees linear-time matching on arbitrary LLM output, use it when installed
+try:
+    import re2 as _re_engine
+except ImportError:
+    _re_engine = re
+
+SQL_PATTERN = _re_engine.compile(r"(?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP|GRANT|REVOKE|TRUNCATE|MERGE|CALL|EXPLAIN|SHOW|USE|IS|NOT|AND|NULL|UNION|ALL|WHERE|FROM)\b.*?;", _re_engine.IGNORECASE | _re_engine.DOTALL)
+
 def save_string_to_csv(filename, string_to_save):
     with open(filename, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
@@ -55,8 +63,7 @@ def save_results(chain_response:dict, output_dir:str, prompt_file:str):
         file.write(str(chain_response['result']))
 
 def extract_sql_statement(text):
-    sql_pattern = re.compile(r"(SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP|GRANT|REVOKE|TRUNCATE|MERGE|CALL|EXPLAIN|SHOW|USE|IS|NOT|AND|NULL|UNION|ALL|WHERE|FROM)\b.*?;", re.IGNORECASE | re.DOTALL)
-    match = sql_pattern.search(text)
+    match = SQL_PATTERN.search(text)
     # If a match is found, return the matched string
     if match:
         return match.group(0)
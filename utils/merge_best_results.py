@@ -3,7 +3,16 @@ import os
 import glob
 import argparse
 import pandas as pd
-from typing import List, Dict, Set
+from typing import List, Dict, Optional
+
+# PyArrow's multithreaded CSV reader is faster than pandas for many small files, use it when installed
+# (concat_tables(promote_options=...) needs pyarrow >= 14, older versions fall back to pandas below)
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+    pacsv = None
 
 
 BASE_PROMPTS = [
@@ -32,13 +41,24 @@ def expected_prompts_for_database(database_name: str) -> List[str]:
     return prompts
 
 
-def merge_best_new_plots(best_new_plots_dir: str, out_path: str) -> None:
-    pattern = os.path.join(best_new_plots_dir, '*-table-all_runs.csv')
-    files = sorted(glob.glob(pattern))
-    if not files:
-        pd.DataFrame(columns=['Database','Prompt','Error']).to_csv(out_path, index=False)
-        print(f"Found 0 inputs; wrote empty CSV to {out_path}")
-        return
+def read_and_concat_csvs(files: List[str]) -> Optional[pd.DataFrame]:
+    """Read and concatenate CSV files, aligning differing column sets. Returns None if nothing was readable."""
+    if pacsv is not None:
+        tables = []
+        for f in files:
+            try:
+                tables.append(pacsv.read_csv(f))
+            except Exception as e:
+                print(f"Warning: Failed to read {f}: {e}")
+        if not tables:
+            return None
+        # Permissive promotion unions the column sets and unifies e.g. int/float metric columns.
+        # On TypeError (pyarrow < 14 has no promote_options, or the column types cannot be unified)
+        # fall through to the pandas reader below
+        try:
+            return pa.concat_tables(tables, promote_options='permissive').to_pandas()
+        except TypeError:
+            pass
 
     frames: List[pd.DataFrame] = []
     for f in files:
@@ -47,32 +67,31 @@ def merge_best_new_plots(best_new_plots_dir: str, out_path: str) -> None:
             frames.append(df)
         except Exception as e:
             print(f"Warning: Failed to read {f}: {e}")
-
     if not frames:
-        pd.DataFrame(columns=['Database','Prompt','Error']).to_csv(out_path, index=False)
-        print(f"No readable inputs; wrote empty CSV to {out_path}")
-        return
-
-    # Union columns across all frames
-    all_columns: Set[str] = set()
-    for df in frames:
-        all_columns.update(df.columns.tolist())
+        return None
+    # concat already aligns the frames on the union of their columns
+    return pd.concat(frames, ignore_index=True, sort=False)
 
-    # Ensure canonical columns present
-    all_columns.update(['Database','Prompt','Error'])
 
-    # Reindex frames to the union of columns
-    frames = [df.reindex(columns=sorted(all_columns)) for df in frames]
+def merge_best_new_plots(best_new_plots_dir: str, out_path: str) -> None:
+    pattern = os.path.join(best_new_plots_dir, '*-table-all_runs.csv')
+    files = sorted(glob.glob(pattern))
+    if not files:
+        pd.DataFrame(columns=['Database','Prompt','Error']).to_csv(out_path, index=False)
+        print(f"Found 0 inputs; wrote empty CSV to {out_path}")
+        return
 
-    merged = pd.concat(frames, ignore_index=True, sort=False)
+    merged = read_and_concat_csvs(files)
+    if merged is None:
+        pd.DataFrame(columns=['Database','Prompt','Error']).to_csv(out_path, index=False)
+        print(f"No readable inputs; wrote empty CSV to {out_path}")
+        return
 
-    # Normalize NaNs in canonical columns
-    for col in ['Database','Prompt','Error']:
+    # Ensure canonical columns present and normalize their NaNs
+    for col in ('Database','Prompt','Error'):
         if col not in merged.columns:
             merged[col] = ''
-    merged['Database'] = merged['Database'].fillna('')
-    merged['Prompt'] = merged['Prompt'].fillna('')
-    merged['Error'] = merged['Error'].fillna('')
+    merged[['Database','Prompt','Error']] = merged[['Database','Prompt','Error']].fillna('')
 
     # Add placeholders for missing prompts per database
     metric_cols: List[str] = [c for c in merged.columns if c not in ['Database','Prompt','Error']]
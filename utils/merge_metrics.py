@@ -6,7 +6,30 @@ import os
 import re
 import sys
 from ast import literal_eval
-from typing import Dict, List, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Set, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads_json(data: bytes) -> object:
+    # orjson is a much faster C parser, fall back to the stdlib when it is not installed
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def map_threaded(func: Callable, items: List) -> List:
+    """
+    Apply func to every item on a thread pool and return the results in input order.
+    Meant for I/O bound work such as reading many small files.
+    """
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
 
 
 def is_target_db(dir_name: str) -> bool:
@@ -19,15 +42,16 @@ def parse_metrics_file(file_path: str) -> Tuple[Dict[str, float], str]:
     Returns (metrics_dict, raw_text). If parsing fails, metrics_dict will be empty.
     """
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read().strip()
+        with open(file_path, "rb") as f:
+            raw = f.read().strip()
+        text = raw.decode("utf-8")
     except Exception as e:
         sys.stderr.write(f"Failed to read {file_path}: {e}\n")
         return {}, ""
 
-    # Try JSON first
+    # Try JSON first, parsing the bytes directly
     try:
-        data = json.loads(text)
+        data = loads_json(raw)
         if isinstance(data, dict):
             return data, text
     except Exception:
@@ -65,6 +89,8 @@ def collect_metrics(base_dir: str) -> Tuple[List[Dict[str, object]], Set[str]]:
     if not os.path.isdir(base_dir):
         raise FileNotFoundError(f"Base directory does not exist: {base_dir}")
 
+    # First pass: gather every metrics file in output order
+    metric_files: List[Tuple[str, str, str]] = []
     for entry in sorted(os.listdir(base_dir)):
         if not is_target_db(entry):
             continue
@@ -76,35 +102,39 @@ def collect_metrics(base_dir: str) -> Tuple[List[Dict[str, object]], Set[str]]:
         if not os.path.isdir(new_results_dir):
             continue
 
-        # Find *_METRICS.txt files
+        # Find *_METRICS.txt files (DirEntry.is_file() reuses the type from the directory read)
         try:
-            candidate_files = [
-                f for f in os.listdir(new_results_dir)
-                if f.endswith("_METRICS.txt") and os.path.isfile(os.path.join(new_results_dir, f))
-            ]
+            with os.scandir(new_results_dir) as it:
+                candidate_files = [
+                    e for e in it
+                    if e.name.endswith("_METRICS.txt") and e.is_file()
+                ]
         except Exception:
             candidate_files = []
 
-        for file_name in sorted(candidate_files):
-            file_path = os.path.join(new_results_dir, file_name)
-            metrics, raw = parse_metrics_file(file_path)
-
-            row: Dict[str, object] = {
-                "database": entry,
-                "metric_file": file_name,
-            }
-
-            if metrics:
-                for k, v in metrics.items():
-                    # Ensure numeric values are kept as numbers where possible
-                    row[k] = v
-                all_metric_keys.update(metrics.keys())
-            else:
-                # If nothing parsed, store raw text for debugging
-                row["raw_content"] = raw
-                all_metric_keys.add("raw_content")
-
-            rows.append(row)
+        for file_entry in sorted(candidate_files, key=lambda e: e.name):
+            metric_files.append((entry, file_entry.name, file_entry.path))
+
+    # Second pass: read and parse the files
+    parsed = map_threaded(parse_metrics_file, [path for _, _, path in metric_files])
+
+    for (entry, file_name, _), (metrics, raw) in zip(metric_files, parsed):
+        row: Dict[str, object] = {
+            "database": entry,
+            "metric_file": file_name,
+        }
+
+        if metrics:
+            for k, v in metrics.items():
+                # Ensure numeric values are kept as numbers where possible
+                row[k] = v
+            all_metric_keys.update(metrics.keys())
+        else:
+            # If nothing parsed, store raw text for debugging
+            row["raw_content"] = raw
+            all_metric_keys.add("raw_content")
+
+        rows.append(row)
 
     return rows, all_metric_keys
 
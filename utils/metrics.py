@@ -1,7 +1,17 @@
 '''
     Description: script to calculate all similarity metrics
 '''
-from Levenshtein import distance
+import numpy as np
+from rapidfuzz.distance import Levenshtein
+from rapidfuzz.process import cdist
+
+# Arrow joins the row strings in native code, fall back to a pandas row-wise join when it is not installed
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
 
 
 # Calculate all similiarity measures
@@ -16,32 +26,21 @@ def dataframe_similarity(df1,df2):
             }
 
 
-##### Comparison based on all columns
-def dataframe_similiarity_full(df1,df2):
+# Row tuples of both frames as sets; row order does not matter for set membership, so no sorting is needed
+def _row_sets(df1, df2):
+    return set(map(tuple, df1.to_numpy())), set(map(tuple, df2.to_numpy()))
 
-   # Ensure both dataframes compare the same columns, sorted alphabetically
-    if set(df1.columns) != set(df2.columns):
-        return "Can't calculate Precision, Recall and F1. DataFrames must have the same columns"
-     
-    df1 = df1.sort_values(by=list(df1.columns)).reset_index(drop=True)
-    df2 = df2.sort_values(by=list(df1.columns)).reset_index(drop=True)
 
-    # Create tuples of the rows
-    df1['combined'] = df1.apply(lambda row: tuple(row), axis=1)
-    df2['combined'] = df2.apply(lambda row: tuple(row), axis=1)
-    
-    # Create sets of the tuple rows for fast comparison
-    set_df1 = set(df1['combined'])
-    set_df2 = set(df2['combined'])
-    
+# Precision, recall and F1 of the rows in set_df1 against the rows in set_df2
+def _set_scores(set_df1, set_df2):
     # True Positives (TP): Items in both sets
-    tp = len(set_df1.intersection(set_df2))
+    tp = len(set_df1 & set_df2)
     
-    # False Positives (FP): Items in df1 but not in df2
-    fp = len(set_df1 - set_df2)
+    # False Positives (FP): Items in df1 but not in df2, i.e. |df1| - |df1 & df2|
+    fp = len(set_df1) - tp
     
-    # False Negatives (FN): Items in df2 but not in df1
-    fn = len(set_df2 - set_df1)
+    # False Negatives (FN): Items in df2 but not in df1, i.e. |df2| - |df1 & df2|
+    fn = len(set_df2) - tp
     
     # Calculating precision, recall, and F1-score
     precision = tp / (tp + fp) if (tp + fp) > 0 else 0
@@ -51,6 +50,16 @@ def dataframe_similiarity_full(df1,df2):
     return {'precision':round(precision,3), 'recall':round(recall,3), 'f1':round(f1,3) }
 
 
+##### Comparison based on all columns
+def dataframe_similiarity_full(df1,df2):
+
+   # Ensure both dataframes compare the same columns
+    if set(df1.columns) != set(df2.columns):
+        return "Can't calculate Precision, Recall and F1. DataFrames must have the same columns"
+
+    return _set_scores(*_row_sets(df1, df2))
+
+
 ##### Comparison based on all columns except activity_id
 def dataframe_similarity_relaxed(df1, df2):
     
@@ -58,65 +67,55 @@ def dataframe_similarity_relaxed(df1, df2):
     df1=df1.drop(['activity_id'], axis=1)
     df2=df2.drop(['activity_id'], axis=1)
 
-   # Ensure both dataframes compare the same columns, sorted alphabetically
+   # Ensure both dataframes compare the same columns
     if set(df1.columns) != set(df2.columns):
         return "Can't calculate Precision, Recall and F1. DataFrames must have the same columns"
 
-    df1 = df1.sort_values(by=list(df1.columns)).reset_index(drop=True)
-    df2 = df2.sort_values(by=list(df1.columns)).reset_index(drop=True)
-    
-    # Create tuples of the rows
-    df1['combined'] = df1.apply(lambda row: tuple(row), axis=1)
-    df2['combined'] = df2.apply(lambda row: tuple(row), axis=1)
-    
-    # Create sets of the tuple rows for fast comparison
-    set_df1 = set(df1['combined'])
-    set_df2 = set(df2['combined'])
-    
-    # True Positives (TP): Items in both sets
-    tp = len(set_df1.intersection(set_df2))
-    
-    # False Positives (FP): Items in df1 but not in df2
-    fp = len(set_df1 - set_df2)
-    
-    # False Negatives (FN): Items in df2 but not in df1
-    fn = len(set_df2 - set_df1)
-    
-    # Calculating precision, recall, and F1-score
-    precision = tp / (tp + fp) if (tp + fp) > 0 else 0
-    recall = tp / (tp + fn) if (tp + fn) > 0 else 0
-    f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0    
+    return _set_scores(*_row_sets(df1, df2))
 
-    return {'precision':round(precision,3), 'recall':round(recall,3), 'f1':round(f1,3)}
+
+# Join the values of every row into one ";"-separated string, missing values become ""
+def join_rows(df):
+    # apply(axis=1) on an empty frame returns a DataFrame instead of a Series
+    if len(df) == 0:
+        return []
+    if pa is None:
+        return df.fillna("").apply(";".join, axis=1).tolist()
+
+    cols = [pc.cast(pa.array(df[c].to_numpy(), from_pandas=True), pa.string()).fill_null("") for c in df.columns]
+    return pc.binary_join_element_wise(*cols, ";").to_pylist()
 
 
 ##### Comparison based on all columns using Levenshtein distance
 def dataframe_similiarity_textual(df1,df2, threshold=0.75):
 
-   # Ensure both dataframes compare the same columns, sorted alphabetically
+   # Ensure both dataframes compare the same columns
     if set(df1.columns) != set(df2.columns):
         return "Can't calculate Precision, Recall and F1. DataFrames must have the same columns"
 
-    df1 = df1.sort_values(by=list(df1.columns)).reset_index(drop=True)
-    df2 = df2.sort_values(by=list(df1.columns)).reset_index(drop=True)
+    # Every label is scored independently against all predictions, so the row order does not matter
 
     ##### Textual comparison based on all columns
     tp, fp, fn = 0, 0, 0
 
-    df2.fillna("",inplace=True)
+    labels = join_rows(df1)
+    preds = join_rows(df2)
+
+    # Labels reproduced exactly by a prediction are matches, no edit distance needed
+    preds_set = set(preds)
+    remaining_labels = [label for label in labels if label not in preds_set]
+    tp = len(labels) - len(remaining_labels)
 
-    labels = df1.apply(";".join, axis=1)
-    preds = df2.apply(";".join, axis=1)
+    # Without predictions only the exact matches (none) count, cdist would return an (n, 0) matrix
+    if remaining_labels and preds:
+        # Levenshtein distance divided by the longer string length for every (label, pred) pair;
+        # the cutoff lets rapidfuzz stop early on pairs that can no longer reach the threshold
+        distances = cdist(remaining_labels, preds, scorer=Levenshtein.normalized_distance,
+                          score_cutoff=1 - threshold, dtype=np.float64, workers=-1)
+        similarity_scores = 1 - distances.min(axis=1)
+        tp += int((similarity_scores >= threshold).sum())
 
-    for label in labels:
-        similarity_list=[]
-        for pred in preds:
-            similarity_list.append(distance(label,pred)/max(len(label), len(pred)))
-        similarity_score = 1 - min(similarity_list) 
-        if similarity_score >= threshold:
-            tp += 1
-        else:
-            fp += 1
+    fp = len(labels) - tp
 
     fn = max(len(labels),len(preds)) - tp
 
@@ -3,114 +3,256 @@
     chart per DB considering all available versions.
 '''
 import os
+import re
 import json
+import hashlib
+import itertools
+from ast import literal_eval
+from functools import lru_cache
 import pandas as pd
+import matplotlib
+
+# Batch runs only save PDFs, PROCESS_ANALYTICS_HEADLESS=1 selects the non-interactive Agg backend
+# (this has to happen before pyplot is imported) and turns plt.show() off by default
+_HEADLESS = os.environ.get('PROCESS_ANALYTICS_HEADLESS', '') not in ('', '0')
+if _HEADLESS:
+    matplotlib.use('Agg')
+
 import matplotlib.pyplot as plt
 from pandas.plotting import parallel_coordinates
 import numpy as np
 
-def plot_parallel_coordinates(path_to_dbs, db_name, metric, relaxed):
-    data = []
-    parent_folder = path_to_dbs
+from utils.merge_metrics import loads_json, map_threaded
 
-    for folder in os.listdir(parent_folder):
-        if folder.startswith(db_name):
-            folder_path = os.path.join(parent_folder, folder, 'best_new_results')
-            if os.path.exists(folder_path):
-                for file in os.listdir(folder_path):
-                    if file.endswith('_METRICS.txt'):
-                        parts = file.split('_')
-                        prompt_name = parts[1] # Extract prompt name
-                        file_path = os.path.join(folder_path, file)
-                        try:
-                            with open(file_path, 'r') as f:
-                                file_content = f.read().strip()
-                                if file_content and file_content != '{}':
-                                    file_content = file_content.replace("'", '"')
-                                    metrics = json.loads(file_content)
-                                    metric_key = relaxed + metric
-                                    if metric_key in metrics:
-                                        metric_value = metrics[metric_key]
-                                        data.append({
-                                            'Folder': folder,
-                                            'Prompt': prompt_name.replace('prompt-','').replace('.txt',''),
-                                            metric: metric_value
-                                        })
-                                    else:
-                                        print(f"Warning: {file_path} missing key '{metric_key}'")
-                                else:
-                                    print(f"Warning: {file_path} is empty or contains empty dict.")
-                            f.close()
-                        except json.JSONDecodeError as e:
-                            print(f"Error decoding JSON in file {file_path}: {e}")
-                        except Exception as e:
-                            print(f"Unexpected error processing file {file_path}: {e}")
-
-    df = pd.DataFrame(data)
-
-    # Rename string values to comply with the paper
-    df['Folder']=df['Folder'].replace({
-        'P2P-V03': 'P2P-V1',
-        'P2P-V15': 'P2P-V2',
-        'P2P-V63': 'P2P-V3',
-        'ERP-V019': 'ERP-V1',
-        'ERP-V209': 'ERP-V2',
-        'ERP-V511': 'ERP-V3',
-        'BPI2016-V07':'BPI2016-V1',
-        'BPI2016-V24':'BPI2016-V2',
-        'BPI2016-V31':'BPI2016-V3',
-        'UWV-V06':'UWV-V1',
-        'UWV-V22':'UWV-V2',
-        'UWV-V31':'UWV-V3'
-        })
-    
-    df['Prompt']=df['Prompt'].replace({
-        '01-baseline':                '1',
-        '02-persona':                 '2',
-        '03-few-shot-example':        '3',
-        '04-chain-of-thought':        '4',
-        '05-tree-of-thought':         '5',
-        '06-processmining-knowledge': '6',
-        '07-RunningExample':          '7',
-        '07-paperj':                  '7',
-        '07-BPI2016':                 '7',
-        '07-UWV':                     '7',
-        })
+# Rename folders and prompts to the names used in the paper
+_FOLDER_MAP = {
+    'P2P-V03': 'P2P-V1',
+    'P2P-V15': 'P2P-V2',
+    'P2P-V63': 'P2P-V3',
+    'ERP-V019': 'ERP-V1',
+    'ERP-V209': 'ERP-V2',
+    'ERP-V511': 'ERP-V3',
+    'BPI2016-V07':'BPI2016-V1',
+    'BPI2016-V24':'BPI2016-V2',
+    'BPI2016-V31':'BPI2016-V3',
+    'UWV-V06':'UWV-V1',
+    'UWV-V22':'UWV-V2',
+    'UWV-V31':'UWV-V3'
+    }
 
-    plot_metric=metric
-    metric_replace = {
-        'f1': 'F1-score',
-        'relaxed-f1': 'F1-score',
-        'textual-f1': 'F1-score'
-        }
-    for key in metric_replace.keys():
-        plot_metric = plot_metric.replace(key, metric_replace[key])
+_PROMPT_MAP = {
+    '01-baseline':                '1',
+    '02-persona':                 '2',
+    '03-few-shot-example':        '3',
+    '04-chain-of-thought':        '4',
+    '05-tree-of-thought':         '5',
+    '06-processmining-knowledge': '6',
+    '07-RunningExample':          '7',
+    '07-paperj':                  '7',
+    '07-BPI2016':                 '7',
+    '07-UWV':                     '7',
+    }
 
+_METRIC_REPLACE = {
+    'f1': 'F1-score',
+    'relaxed-f1': 'F1-score',
+    'textual-f1': 'F1-score'
+    }
 
-    # Calculate average metric values if multiple runs have occurred
-    df = df.groupby(['Folder','Prompt']).mean()
-    df.reset_index(inplace=True)
-    df.set_index('Folder')
+# Line styles for accessibility
+_PATTERNS = ('\\\\','','////')
+
+# Second "_"-separated field of a metrics file name, the prompt it was generated with
+_FNAME_RE = re.compile(r'^[^_]*_([^_]+)_')
+
+# blake2b hex digest used as the key of the extracted-metrics cache files
+_CACHE_KEY_RE = re.compile(r'[0-9a-f]{32}')
+
+# Strips the "prompt-" prefix and ".txt" suffix from the prompt part of a metrics file name
+_PROMPT_STRIP = re.compile(r'^prompt-|\.txt$')
+
+def _loads_metrics(raw):
+    """Parse a metrics file's bytes, written either as JSON or as a Python dict repr."""
+    try:
+        return loads_json(raw)
+    except ValueError:
+        # A Python repr uses single quotes, literal_eval keeps apostrophes inside values intact
+        return literal_eval(raw.decode('utf-8'))
+
+def _iter_metric_files(parent_folder, db_name, subdir):
+    """Yield (folder, DirEntry) for every *_METRICS.txt file in <parent_folder>/<db_name>*/<subdir>."""
+    with os.scandir(parent_folder) as folders:
+        for folder_entry in folders:
+            if not (folder_entry.name.startswith(db_name) and folder_entry.is_dir(follow_symlinks=False)):
+                continue
+            try:
+                files = os.scandir(os.path.join(folder_entry.path, subdir))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with files:
+                for file_entry in files:
+                    if file_entry.name.endswith('_METRICS.txt'):
+                        yield folder_entry.name, file_entry
+
+def _read_metrics(file_entry):
+    """Read and parse one metrics file. Returns (metrics, error), metrics is None for an empty file or '{}'."""
+    try:
+        # No non-empty metrics dict fits in two bytes, so those files are not even opened
+        if file_entry.stat().st_size <= 2:
+            return None, None
+        with open(file_entry.path, 'rb') as f:
+            file_content = f.read().strip()
+        if not file_content or file_content == b'{}':
+            return None, None
+        return _loads_metrics(file_content), None
+    except Exception as e:
+        return None, e
+
+def _metric_files_key(parent_folder, db_name, subdir):
+    """Hash of the path, modification time and size of every metrics file, changes whenever a file does."""
+    digest = hashlib.blake2b(digest_size=16)
+    for _, file_entry in sorted(_iter_metric_files(parent_folder, db_name, subdir), key=lambda item: item[1].path):
+        st = file_entry.stat()
+        digest.update(f"{file_entry.path}\0{st.st_mtime_ns}\0{st.st_size}\n".encode())
+    return digest.hexdigest()
+
+def _load_metric_files(parent_folder, db_name, subdir, files_key=None):
+    """Read all metrics files of a database, as (folder, DirEntry, metrics, error) in walk order."""
+    # Keyed on the state of the files, so a changed or added metrics file is read again
+    if files_key is None:
+        files_key = _metric_files_key(parent_folder, db_name, subdir)
+    return _load_metric_files_cached(parent_folder, db_name, subdir, files_key)
+
+@lru_cache(maxsize=64)
+def _load_metric_files_cached(parent_folder, db_name, subdir, files_key):
+    # Shared by plot_parallel_coordinates and save_result_tables, which usually run back to back
+    # over the same tree. The result is a tuple and neither caller modifies the metrics dicts.
+    entries = list(_iter_metric_files(parent_folder, db_name, subdir))
+    results = map_threaded(lambda item: _read_metrics(item[1]), entries)
+    return tuple((folder, file_entry, metrics, error) for (folder, file_entry), (metrics, error) in zip(entries, results))
+
+def _collect_metric_values(parent_folder, db_name, results_subdir, metric, metric_key, files_key=None):
+    """Long-form (Folder, Prompt, metric) frame with one row per metrics file that contains metric_key."""
+    # One entry per parsed metrics file in each of the parallel lists
+    folders, prompts, file_paths, metrics_list = [], [], [], []
+
+    for folder, file_entry, metrics, error in _load_metric_files(parent_folder, db_name, results_subdir, files_key):
+        match = _FNAME_RE.match(file_entry.name)
+        if not match:
+            continue
+        prompt_name = _PROMPT_STRIP.sub('', match.group(1)) # Extract prompt name
+        file_path = file_entry.path
+        try:
+            if error is not None:
+                raise error
+            if metrics is not None:
+                folders.append(folder)
+                prompts.append(prompt_name)
+                file_paths.append(file_path)
+                metrics_list.append(metrics if isinstance(metrics, dict) else {})
+            else:
+                print(f"Warning: {file_path} is empty or contains empty dict.")
+        except (ValueError, SyntaxError) as e:
+            print(f"Error decoding JSON in file {file_path}: {e}")
+        except Exception as e:
+            print(f"Unexpected error processing file {file_path}: {e}")
+
+    # Extract the metric from all files at once, files without it come out as NaN and are dropped
+    metrics_wide = pd.json_normalize(metrics_list)
+    if metric_key in metrics_wide.columns:
+        values = pd.to_numeric(metrics_wide[metric_key], errors='coerce').to_numpy(dtype=np.float64)
+    else:
+        values = np.full(len(metrics_list), np.nan)
+    found = ~np.isnan(values)
+    for file_path in itertools.compress(file_paths, ~found):
+        print(f"Warning: {file_path} missing key '{metric_key}'")
+
+    return pd.DataFrame({
+        'Folder': folders,
+        'Prompt': prompts,
+        metric: values
+    })[found].reset_index(drop=True)
+
+def _read_cached_frame(cache_path):
+    # Parquet needs pyarrow or fastparquet, without them (or on a broken file) the cache is simply a miss
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        return pd.read_parquet(cache_path)
+    except (ImportError, ValueError, OSError):
+        return None
+
+def _write_cached_frame(df, cache_path, stale_prefix):
+    """Write df to cache_path and delete older cache files named stale_prefix + <other key>.parquet."""
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        df.to_parquet(cache_path, index=False)
+    except ImportError:
+        # No parquet engine installed, run without the cache
+        return
+    except (ValueError, OSError) as e:
+        print(f"Warning: Could not write cache {cache_path}: {e}")
+        return
+
+    # Older keys belong to a previous state of the metrics files, drop them so the cache does not keep growing
+    cache_dir, cache_name = os.path.split(cache_path)
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            key = entry.name[len(stale_prefix):-len('.parquet')]
+            if (entry.name != cache_name and entry.name.startswith(stale_prefix) and entry.name.endswith('.parquet')
+                    and _CACHE_KEY_RE.fullmatch(key)):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+def plot_parallel_coordinates(path_to_dbs, db_name, metric, relaxed, results_subdir='best_new_results', out_dir='best_new_plots', show=None):
+    parent_folder = path_to_dbs
+    metric_key = relaxed + metric
 
-    # Pivot the DataFrame to have folders as rows and prompt names as columns
-    pivot_df = df.pivot(index='Prompt', columns='Folder', values=metric)
+    # Re-running only to tweak the chart reuses the extracted metrics as long as no metrics file changed
+    cache_key = _metric_files_key(parent_folder, db_name, results_subdir)
+    cache_prefix = f"{db_name}-{metric_key}-"
+    cache_path = os.path.join(out_dir, '_cache', f"{cache_prefix}{cache_key}.parquet")
+    df = _read_cached_frame(cache_path)
+    if df is None:
+        df = _collect_metric_values(parent_folder, db_name, results_subdir, metric, metric_key, cache_key)
+        _write_cached_frame(df, cache_path, cache_prefix)
+    else:
+        # relaxed='relaxed_', metric='f1' and relaxed='', metric='relaxed_f1' share a cache file
+        df.columns = ['Folder', 'Prompt', metric]
+
+    # Rename string values to comply with the paper. On a categorical column the mapping
+    # only runs once per distinct value instead of once per row.
+    df['Folder'] = df['Folder'].astype('category').map(lambda c: _FOLDER_MAP.get(c, c))
+    df['Prompt'] = df['Prompt'].astype('category').map(lambda c: _PROMPT_MAP.get(c, c))
 
-    # Fill NaN values with -1
-    pivot_df = pivot_df.fillna(-0.2)
+    plot_metric=metric
+    for key, value in _METRIC_REPLACE.items():
+        plot_metric = plot_metric.replace(key, value)
 
-    # Define line styles for accessibility
-    patterns = ['\\\\','','////']
 
-    # Plot figures as bar charts
-    plt.figure(figsize=(12, 6))
+    # Calculate average metric values if multiple runs have occurred, a single run per pair is already its own mean
+    # (observed=True keeps only the combinations present, the sorted keys keep the saved CSV in a stable order)
+    if df.duplicated(['Folder','Prompt']).any():
+        df = df.groupby(['Folder','Prompt'], observed=True, as_index=False)[metric].mean()
+    else:
+        # Same row order as the grouped path, otherwise the rows follow the directory walk
+        df = df.sort_values(['Folder','Prompt'], ignore_index=True)
+
+    # Pivot the DataFrame to have prompts as rows and folder names as columns,
+    # missing combinations are filled with -0.2 in the same pass
+    pivot_df = df.set_index(['Prompt','Folder'])[metric].unstack(fill_value=-0.2)
+
+    # Plot figures as bar charts (pandas creates the figure itself, so no separate plt.figure is needed)
     ax = pivot_df.plot.bar(rot=0, zorder=100, fill=False)
+    fig = ax.figure
     bars = ax.patches
 
-    hatches=[]
-
-    for j in range(pivot_df.shape[1]):
-        for _ in range(pivot_df.shape[0]):
-            hatches.append(patterns[j])
+    # Bars are ordered column by column, so every folder's pattern repeats once per prompt;
+    # with more folders than patterns the patterns are reused in turn
+    nrows, ncols = pivot_df.shape
+    hatches = np.repeat(np.resize(np.array(_PATTERNS), ncols), nrows).tolist()
 
     for bar,hatch in zip(bars,hatches):
          bar.set_hatch(hatch)
@@ -140,113 +282,92 @@ def plot_parallel_coordinates(path_to_dbs, db_name, metric, relaxed):
     plt.grid(axis='y', linestyle='--', color='lightgray', zorder=-99)
 
     # Create plots directory if it doesn't exist
-    os.makedirs('best_new_plots', exist_ok=True)
+    os.makedirs(out_dir, exist_ok=True)
     
     # Save the DataFrame as CSV
-    df.to_csv('best_new_plots/' + db_name + '-plot-data-' + relaxed + metric + '.csv', index=False)
+    df.to_csv(os.path.join(out_dir, db_name + '-plot-data-' + relaxed + metric + '.csv'), index=False)
     
     # Save the plot as a PDF file
-    plt.savefig('best_new_plots/' + db_name + '-plot-' + relaxed + metric + '.pdf', format='pdf', bbox_inches='tight')
+    fig.savefig(os.path.join(out_dir, db_name + '-plot-' + relaxed + metric + '.pdf'), format='pdf', bbox_inches='tight')
 
-    plt.show()
+    if show is None:
+        show = not _HEADLESS
+    if show:
+        plt.show()
+    # Release the figure so repeated calls do not keep every chart alive in pyplot
+    plt.close(fig)
 
 
-def save_result_tables(path_to_dbs, db_name, relaxed):
-    data = []
+def save_result_tables(path_to_dbs, db_name, relaxed, results_subdir='best_new_results', out_dir='best_new_plots', table_dir='new_plots'):
+    # Identifier columns as lists, plus the metrics dict of every row
+    id_cols = {'Database': [], 'Prompt': [], 'Error': []}
+    row_metrics = []
     parent_folder = path_to_dbs
 
-    for folder in os.listdir(parent_folder):
-        if folder.startswith(db_name):
-            folder_path = os.path.join(parent_folder, folder, 'best_new_results')
-            if os.path.exists(folder_path):
-                for file in os.listdir(folder_path):
-                    if file.endswith('_METRICS.txt'):
-                        parts = file.split('_')
-                        prompt_name = parts[1] # Extract prompt name
-                        file_path = os.path.join(folder_path, file)
-                        try:
-                            with open(file_path, 'r') as f:
-                                file_content = f.read().strip()
-                                if file_content and file_content != '{}':
-                                    file_content = file_content.replace("'", '"')
-                                    metrics = json.loads(file_content)
-                                    # Only add if metrics contains valid data
-                                    if metrics:
-                                        data.append({
-                                            'Database': folder,
-                                            'Prompt': prompt_name.replace('prompt-','').replace('.txt',''),
-                                            'Error': '',
-                                            'Metrics': metrics
-                                        })
-                                    else:
-                                        # Parsed but empty dict
-                                        data.append({
-                                            'Database': folder,
-                                            'Prompt': prompt_name.replace('prompt-','').replace('.txt',''),
-                                            'Error': 'NO_METRICS',
-                                            'Metrics': {}
-                                        })
-                                else:
-                                    # Empty or '{}'
-                                    print(f"Warning: {file_path} is empty or contains empty dict.")
-                                    data.append({
-                                        'Database': folder,
-                                        'Prompt': prompt_name.replace('prompt-','').replace('.txt',''),
-                                        'Error': 'NO_METRICS',
-                                        'Metrics': {}
-                                    })
-                            f.close()
-                        except json.JSONDecodeError as e:
-                            print(f"Error decoding JSON in file {file_path}: {e}")
-                            data.append({
-                                'Database': folder,
-                                'Prompt': prompt_name.replace('prompt-','').replace('.txt',''),
-                                'Error': 'JSON_DECODE_ERROR',
-                                'Metrics': {}
-                            })
-                        except Exception as e:
-                            print(f"Unexpected error processing file {file_path}: {e}")
-                            data.append({
-                                'Database': folder,
-                                'Prompt': prompt_name.replace('prompt-','').replace('.txt',''),
-                                'Error': f"ERROR:{type(e).__name__}",
-                                'Metrics': {}
-                            })
-
-    df0 = pd.DataFrame(data)
-    print(f"Found {len(data)} metric files (including errors) for {db_name}")
+    def add_row(folder, prompt_name, error, metrics):
+        id_cols['Database'].append(folder)
+        id_cols['Prompt'].append(prompt_name)
+        id_cols['Error'].append(error)
+        row_metrics.append(metrics)
+
+    for folder, file_entry, metrics, error in _load_metric_files(parent_folder, db_name, results_subdir):
+        match = _FNAME_RE.match(file_entry.name)
+        if not match:
+            continue
+        prompt_name = _PROMPT_STRIP.sub('', match.group(1)) # Extract prompt name
+        file_path = file_entry.path
+        try:
+            if error is not None:
+                raise error
+            if metrics is not None:
+                # Only add if metrics contains valid data
+                if isinstance(metrics, dict) and metrics:
+                    add_row(folder, prompt_name, '', metrics)
+                else:
+                    # Parsed but empty dict
+                    add_row(folder, prompt_name, 'NO_METRICS', {})
+            else:
+                # Empty or '{}'
+                print(f"Warning: {file_path} is empty or contains empty dict.")
+                add_row(folder, prompt_name, 'NO_METRICS', {})
+        except (ValueError, SyntaxError) as e:
+            print(f"Error decoding JSON in file {file_path}: {e}")
+            add_row(folder, prompt_name, 'JSON_DECODE_ERROR', {})
+        except Exception as e:
+            print(f"Unexpected error processing file {file_path}: {e}")
+            add_row(folder, prompt_name, f"ERROR:{type(e).__name__}", {})
+
+    print(f"Found {len(row_metrics)} metric files (including errors) for {db_name}")
     
     # Always write an all-runs CSV, even if empty
-    os.makedirs('best_new_plots', exist_ok=True)
-    if df0.empty:
+    os.makedirs(out_dir, exist_ok=True)
+    if not row_metrics:
         # Write an empty CSV with headers
-        pd.DataFrame(columns=['Database','Prompt','Error']).to_csv('best_new_plots/' + db_name + '-table-all_runs.csv', index=False)
-        # Also write placeholder to new_plots
-        os.makedirs('new_plots', exist_ok=True)
-        pd.DataFrame(columns=['Database','Prompt','Error']).to_csv('new_plots/' + db_name + '-table.csv', index=False)
+        pd.DataFrame(columns=['Database','Prompt','Error']).to_csv(os.path.join(out_dir, db_name + '-table-all_runs.csv'), index=False)
+        # Also write placeholder to the per-DB table directory
+        os.makedirs(table_dir, exist_ok=True)
+        pd.DataFrame(columns=['Database','Prompt','Error']).to_csv(os.path.join(table_dir, db_name + '-table.csv'), index=False)
         print(f"No metric files found for {db_name}; wrote empty CSVs.")
         return
 
-    # Put the Metrics column, which contains dicts, into a seperate dataframe
-    dfm = pd.DataFrame.from_records(df0['Metrics'].values)
-    # Combine the Metrics dataframe with the Folder+Prompt+Error columns from the original DataFrame
-    df = pd.concat([df0[['Database','Prompt','Error']], dfm], axis=1)
+    # One column per metric key in first-seen order, rows without the key get NaN
+    metric_keys = dict.fromkeys(key for metrics in row_metrics for key in metrics)
+    metric_cols = {key: [metrics.get(key, np.nan) for metrics in row_metrics] for key in metric_keys}
+    df = pd.DataFrame({**id_cols, **metric_cols})
 
     # Write the all-runs table
-    df.to_csv('best_new_plots/' + db_name + '-table-all_runs.csv', index=False)
+    df.to_csv(os.path.join(out_dir, db_name + '-table-all_runs.csv'), index=False)
 
     # Calculate average metric values if multiple runs have occurred
     # Keep only numeric columns for aggregation
-    numeric_cols = df.select_dtypes(include=[float, int]).columns.tolist()
+    numeric_cols = df.columns[[dtype.kind in 'fiu' for dtype in df.dtypes]].tolist()
     if numeric_cols:
-        df_agg = df.groupby(['Database','Prompt'])[numeric_cols].mean()
-        df_agg.reset_index(inplace=True)
-        df_agg.set_index('Database')
-        os.makedirs('new_plots', exist_ok=True)
-        df_agg.to_csv('new_plots/' + db_name + '-table.csv', index=False)
+        df_agg = df.groupby(['Database','Prompt'], observed=True, as_index=False)[numeric_cols].mean()
+        os.makedirs(table_dir, exist_ok=True)
+        df_agg.to_csv(os.path.join(table_dir, db_name + '-table.csv'), index=False)
     else:
         # No numeric metrics available; write a placeholder CSV with errors only
-        os.makedirs('new_plots', exist_ok=True)
-        df[['Database','Prompt','Error']].to_csv('new_plots/' + db_name + '-table.csv', index=False)
+        os.makedirs(table_dir, exist_ok=True)
+        df[['Database','Prompt','Error']].to_csv(os.path.join(table_dir, db_name + '-table.csv'), index=False)
 
     return
\ No newline at end of file